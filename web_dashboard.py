@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
-import os, json, threading, logging, signal
+import os, threading, logging, signal, socket, queue, string, hashlib, struct, types
+from collections import deque
 from datetime import datetime, timedelta
-from flask import Flask, jsonify, Response
-import requests
-from pymodbus.client.sync import ModbusTcpClient
+from typing import Any, Mapping
+from flask import Flask, Response, request, send_from_directory
+from flask_compress import Compress  # type: ignore[import-untyped]
+from waitress import serve  # type: ignore[import-untyped]
+import requests  # type: ignore[import-untyped]
+from requests.adapters import HTTPAdapter  # type: ignore[import-untyped]
+import orjson
+from pymodbus.client.sync import ModbusTcpClient  # type: ignore[import-untyped]
 
 # ========== CONFIG ==========
 MODBUS_HOST = os.getenv("MODBUS_HOST", "192.168.1.220")
@@ -17,6 +23,8 @@ PV_SYSTEM_ID = os.getenv("PVOUTPUT_SYSTEM_ID", "")
 STATE_DIR = os.getenv("STATE_DIR", "/data")
 os.makedirs(STATE_DIR, exist_ok=True)
 STATE_PATH = os.path.join(STATE_DIR, "state.json")
+BASELINE_PATH = os.path.join(STATE_DIR, "energy_baseline.json")
+FSYNC_EVERY = max(0, int(os.getenv("FSYNC_EVERY", "0")))  # 0 = never fsync state.json
 
 # ========== LOGGING ==========
 logging.basicConfig(
@@ -26,12 +34,13 @@ logging.basicConfig(
 log = logging.getLogger("vsn300-pvoutput")
 
 # ========== STATE ==========
+# Guards `state` and the chart buffers between the poller and uploader threads;
+# HTTP handlers read the published snapshot instead.
 state_lock = threading.Lock()
-state = {
+state: dict[str, Any] = {
     "debug": DEBUG, "dry_run": DRY_RUN,
     "inverter_connected": False,
     "last_upload": None, "uptime_minutes_today": 0,
-    "records": [],
     "ac_voltage": None, "grid_freq_hz": None, "inverter_temp_c": None,
     "energy_today_kwh": 0.0, "energy_total_kwh": None,
     "peak_power_w": 0, "status_code": None,
@@ -42,49 +51,119 @@ state = {
 }
 stop_event = threading.Event()
 
-# ---------- Helpers ----------
-def _with_lock_read():
-    with state_lock: return dict(state)
+# Chart series for today (one entry per poll), kept as parallel ring buffers so
+# /data ships plain arrays: labels "HH:MM", power W, energy kWh.
+_labels: deque[str] = deque(maxlen=288)
+_powers: deque[int] = deque(maxlen=288)
+_energies: deque[float] = deque(maxlen=288)
+
+def _records_payload() -> dict[str, list[Any]]:
+    return {"l": list(_labels), "p": list(_powers), "e": list(_energies)}
 
-def u32_from_words(low, high):
+# Immutable copy of `state` republished by the poller; handlers read it lock-free.
+_snapshot: dict[str, Any] = dict(state, records=_records_payload())
+_snapshot_json: bytes | None = None  # orjson bytes of _snapshot, rebuilt alongside it
+_snapshot_etag: str | None = None  # content hash of _snapshot_json, used for conditional GETs
+
+# ---------- Helpers ----------
+def _publish_snapshot() -> None:
+    """Rebuild the read-only snapshot from `state` and swap it in atomically."""
+    global _snapshot, _snapshot_json, _snapshot_etag
+    with state_lock:
+        snap = dict(state)
+        snap["records"] = _records_payload()
+    _snapshot = snap
+    _snapshot_json = orjson.dumps(snap)
+    _snapshot_etag = hashlib.md5(_snapshot_json).hexdigest()
+
+def _read_snapshot() -> Mapping[str, Any]:
+    """Read-only view of the last published snapshot (no lock; shared by all handlers)."""
+    return types.MappingProxyType(_snapshot)
+
+def u32_from_words(low: int, high: int) -> int:
     return ((int(high) & 0xFFFF) << 16) | (int(low) & 0xFFFF)
 
-def today_midnight_local():
+def today_midnight_local() -> datetime:
     n = datetime.now()
     return datetime(n.year, n.month, n.day)
 
-def decode_status(code):
-    m = {0:("Off","muted"),1:("Sleep","sleep"),4:("ON","ok"),5:("Fault","error"),
-         91:("ON","ok"),92:("Sleep","sleep")}
-    return m.get(code, ("Unknown","muted"))
+_STATUS: dict[int, tuple[str, str]] = {
+    0:("Off","muted"),1:("Sleep","sleep"),4:("ON","ok"),5:("Fault","error"),
+    91:("ON","ok"),92:("Sleep","sleep")}
+_STATUS_UNKNOWN = ("Unknown","muted")
 
-def save_state():
-    """Safely write the current state.json with proper UTF-8 and no NaN values."""
+def decode_status(code: int) -> tuple[str, str]:
+    return _STATUS.get(code, _STATUS_UNKNOWN)
+
+# fdatasync skips the inode metadata flush; not available on macOS/Windows
+_datasync = getattr(os, "fdatasync", os.fsync)
+
+def _write_atomic(path: str, data: bytes, sync: bool = False) -> None:
+    """Write bytes to a temp file and rename it over `path` so readers never see a partial file."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        if sync:
+            f.flush()
+            _datasync(f.fileno())
+    os.replace(tmp_path, path)
+
+_save_count = 0
+_last_state_hash: int | None = None
+
+def save_state() -> None:
+    """Safely write the current state.json as UTF-8; orjson writes NaN/Inf as null."""
+    global _save_count, _last_state_hash
     try:
         with state_lock:
             tmp = dict(state)
-        with open(STATE_PATH, "w", encoding="utf-8") as f:
-            json.dump(tmp, f, indent=2, ensure_ascii=False, allow_nan=False)
-            f.flush()
-            os.fsync(f.fileno())  # ensure data hits disk
+            tmp["records"] = _records_payload()
+        payload = orjson.dumps(tmp, option=orjson.OPT_INDENT_2)
+        h = hash(payload)
+        if h == _last_state_hash:
+            return  # nothing changed since the last write (e.g. overnight)
+        _save_count += 1
+        sync = FSYNC_EVERY > 0 and _save_count % FSYNC_EVERY == 0
+        _write_atomic(STATE_PATH, payload, sync=sync)
+        _last_state_hash = h
     except Exception as e:
         log.warning(f"Save state fail: {e}")
 
-def load_state():
+def load_state() -> None:
+    global _baseline_cache
+    baseline = _read_baseline()
+    if baseline is not None:
+        _baseline_cache = {"day": baseline[0], "wh": baseline[1]}
     if not os.path.exists(STATE_PATH):
         return
     try:
-        with open(STATE_PATH) as f:
-            loaded = json.load(f)
+        with open(STATE_PATH, "rb") as f:
+            loaded = orjson.loads(f.read())
+        recs = loaded.pop("records", None) or {}
+        if isinstance(recs, list):
+            # Older state.json stored a list of {"timestamp","power_w","energy_wh"}
+            recs = {
+                "l": [(r.get("timestamp") or "")[11:16] for r in recs],
+                "p": [r.get("power_w", 0) for r in recs],
+                "e": [(r.get("energy_wh") or 0) / 1000 for r in recs],
+            }
         with state_lock:
             state.update(loaded)
+            _labels.extend(recs.get("l", []))
+            _powers.extend(recs.get("p", []))
+            _energies.extend(recs.get("e", []))
             # Set a startup placeholder for data quality
             state["dq_text"], state["dq_class"] = "STARTING", "dq_warn"
         log.info("Loaded previous state.json")
     except Exception as e:
         log.warning(f"Load state fail: {e}")
 
-def pvoutput_addstatus(power_w, energy_wh, voltage_v=None, temp_c=None):
+# Keep-alive session so repeat uploads reuse the TCP/TLS connection
+_pv_session = requests.Session()
+_pv_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+
+def pvoutput_addstatus(power_w: int, energy_wh: float, voltage_v: float | None = None,
+                       temp_c: float | None = None, when: datetime | None = None) -> bool:
     if DRY_RUN:
         msg = f"[DRY_RUN] PVOutput v1={energy_wh}Wh v2={power_w}W"
         if voltage_v is not None:
@@ -96,7 +175,7 @@ def pvoutput_addstatus(power_w, energy_wh, voltage_v=None, temp_c=None):
     if not PV_API_KEY or not PV_SYSTEM_ID:
         log.warning("Missing PVOutput creds."); return False
     h={"X-Pvoutput-Apikey":PV_API_KEY,"X-Pvoutput-SystemId":PV_SYSTEM_ID}
-    now=datetime.now()
+    now=when or datetime.now()
     # d={"d":now.strftime("%Y%m%d"),"t":now.strftime("%H:%M"),
        # "v1":int(round(energy_wh)),"v2":int(round(power_w))}
        # Upload energy as integer Wh, without extra rounding
@@ -108,14 +187,44 @@ def pvoutput_addstatus(power_w, energy_wh, voltage_v=None, temp_c=None):
     if voltage_v is not None:
         d["v6"] = round(voltage_v, 1)  # Volts
     try:
-        r=requests.post("https://pvoutput.org/service/r2/addstatus.jsp",
-                        headers=h,data=d,timeout=10)
+        r=_pv_session.post("https://pvoutput.org/service/r2/addstatus.jsp",
+                           headers=h,data=d,timeout=(3.05,5))
         ok=r.status_code==200 and not (r.text or "").upper().startswith("ERROR")
         log.info("PVOutput upload OK" if ok else f"PVOutput error {r.text.strip()}")
         return ok
     except Exception as e: log.warning(f"PVOutput upload exception: {e}"); return False
 
-def detect_night(ac_voltage, inverter_connected):
+# ---------- Uploader ----------
+# Uploads run on their own thread so a slow PVOutput never delays the next Modbus poll.
+_upload_queue: queue.Queue[tuple[int, float, float, float, datetime]] = queue.Queue(maxsize=4)
+
+def enqueue_upload(power_w: int, energy_wh: float, voltage_v: float, temp_c: float, when: datetime) -> None:
+    """Queue an upload without blocking, dropping the oldest pending one if full."""
+    item = (power_w, energy_wh, voltage_v, temp_c, when)
+    while True:
+        try:
+            _upload_queue.put_nowait(item); return
+        except queue.Full:
+            try: _upload_queue.get_nowait()
+            except queue.Empty: pass
+
+def uploader_loop() -> None:
+    while not stop_event.is_set():
+        try:
+            p, e_wh, v, t, when = _upload_queue.get(timeout=1)
+        except queue.Empty:
+            continue
+        try:
+            if pvoutput_addstatus(p, e_wh, voltage_v=v, temp_c=t, when=when):
+                with state_lock:
+                    state["last_upload"] = when.isoformat(timespec="seconds")
+        except Exception as e:
+            log.warning(f"Upload error: {e}")
+
+def _json_response(obj: Any, status: int = 200) -> Response:
+    return Response(orjson.dumps(obj), status=status, mimetype="application/json")
+
+def detect_night(ac_voltage: float | None, inverter_connected: bool) -> tuple[str, str, bool]:
     """Return (status_text, status_class, night_flag)"""
     if not inverter_connected or ac_voltage is None or ac_voltage < 100:
         return ("Night", "night", True)
@@ -123,76 +232,111 @@ def detect_night(ac_voltage, inverter_connected):
 
 
 # ---------- Modbus ----------
-def read_regs(start,count):
-    c=ModbusTcpClient(MODBUS_HOST,port=MODBUS_PORT,timeout=4)
+# One persistent connection shared by the poller and /raw; reconnects lazily.
+_mb_client = ModbusTcpClient(MODBUS_HOST, port=MODBUS_PORT, timeout=4)
+_mb_lock = threading.Lock()
+_mb_nodelay_set = False
+
+def _mb_reset() -> None:
+    """Drop the shared connection so the next read reconnects."""
+    global _mb_nodelay_set
+    _mb_nodelay_set = False
+    try: _mb_client.close()
+    except: pass
+
+def _mb_tune_socket() -> None:
+    """Disable Nagle and enable keepalive on a freshly opened Modbus socket."""
+    global _mb_nodelay_set
+    try:
+        _mb_client.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        _mb_client.socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        _mb_nodelay_set = True
+    except Exception as e:
+        log.debug(f"Modbus socket tuning failed: {e}")
+
+def _mb_read(start: int, count: int) -> list[int] | None:
+    """One read attempt on the shared client; drops the connection on failure."""
     try:
-        if not c.connect(): return None
-        r=c.read_holding_registers(start,count,unit=MODBUS_UNIT_ID)
-        if not r or r.isError(): return None
+        if not _mb_client.is_socket_open():
+            _mb_reset()
+            if not _mb_client.connect():
+                return None
+        if not _mb_nodelay_set:
+            _mb_tune_socket()
+        r=_mb_client.read_holding_registers(start,count,unit=MODBUS_UNIT_ID)
+        if not r or r.isError():
+            _mb_reset(); return None
         return r.registers
-    finally:
-        try: c.close()
-        except: pass
+    except Exception as e:
+        log.debug(f"Modbus read error: {e}")
+        _mb_reset()
+        return None
+
+def read_regs(start: int, count: int) -> list[int] | None:
+    with _mb_lock:
+        was_open = _mb_client.is_socket_open()
+        regs = _mb_read(start, count)
+        if regs is None and was_open:
+            # The inverter may have dropped an idle connection; reconnect and retry once
+            regs = _mb_read(start, count)
+        return regs
 
-def read_legacy_block():
+# (timestamp, registers) of the last successful Modbus read, served by /raw.
+# Kept out of `state` so it never lands in /data or state.json.
+_last_raw: tuple[str | None, list[int] | None] = (None, None)
+
+# In-memory copy of energy_baseline.json ({"day", "wh"}); loaded once in load_state()
+_baseline_cache: dict[str, Any] | None = None
+
+def _read_baseline() -> tuple[str, Any] | None:
+    """Return (day, wh) from energy_baseline.json, or None if missing/unreadable."""
+    try:
+        with open(BASELINE_PATH, "rb") as bf:
+            prev = orjson.loads(bf.read())
+        return prev["day"], prev["wh"]
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log.warning(f"Baseline read error: {e}")
+        return None
+
+# Registers 80–106 as big-endian words: 80 voltage, 84 power, 86 frequency,
+# 88 status, 94–95 lifetime energy (94 high word, 95 low word), 96 signed
+# scale factor, 106 temperature.
+_LEGACY_BLOCK = struct.Struct(">H6xH2xH2xH10xIh18xH")
+
+def read_legacy_block() -> dict[str, Any] | None:
     """Read and decode Modbus registers from the inverter (VSN300 single-phase)."""
+    global _baseline_cache, _last_raw
     regs = read_regs(80, 40)
     if not regs:
         return None
+    _last_raw = (datetime.now().isoformat(), list(regs))
     if DEBUG:
         log.debug(f"Regs80–119: {regs}")
     try:
+        buf = struct.pack(f">{len(regs)}H", *regs)
+        v_raw, p, f_raw, code, e_raw, sf, t_raw = _LEGACY_BLOCK.unpack_from(buf)
+
         # Basic telemetry
-        v = round(regs[0] / 10.0, 1)          # 80: Voltage (×0.1)
-        f = round(regs[6] / 100.0, 2)         # 86: Frequency (×0.01)
-        t = round(regs[26] / 10.0, 1)         # 106: Temperature (×0.1)
-        p = int(regs[4])                      # 84: Power (W)
-        code = regs[8]                        # 88: Status code
-
-        # Lifetime energy (SunSpec 40093–40094)
-        low = regs[14]                        # 94 (low word)
-        high = regs[15]                       # 95 (high word)
-        sf_reg = regs[16]                     # 96 (scale factor)
-        sf = int(sf_reg if sf_reg < 32768 else sf_reg - 65536)
-        e_raw = (low << 16) | high            # Little-endian
+        v = round(v_raw / 10.0, 1)            # 80: Voltage (×0.1)
+        f = round(f_raw / 100.0, 2)           # 86: Frequency (×0.01)
+        t = round(t_raw / 10.0, 1)            # 106: Temperature (×0.1)
+
+        # Lifetime energy (SunSpec 40093–40094), scale factor is signed
         e_wh = e_raw * (10 ** sf)
 
-        # Load or update baseline (for daily energy)
-        baseline_file = os.path.join(STATE_DIR, "energy_baseline.json")
+        # Daily energy relative to today's baseline; persist it only on a new day
         today = datetime.now().strftime("%Y-%m-%d")
-        baseline = {"day": today, "wh": e_wh}
-        if os.path.exists(baseline_file):
-            try:
-                with open(baseline_file) as bf:
-                    prev = json.load(bf)
-                if prev.get("day") == today:
-                    energy_today_wh = max(0, e_wh - prev.get("wh", e_wh))
-                else:
-                    energy_today_wh = 0
-                    baseline = {"day": today, "wh": e_wh}
-            except Exception as e:
-                log.warning(f"Baseline read error: {e}")
-                energy_today_wh = 0
+        if _baseline_cache is not None and _baseline_cache["day"] == today:
+            energy_today_wh = max(0, e_wh - _baseline_cache["wh"])
         else:
             energy_today_wh = 0
-
-        # Only update baseline file when it changes (new day)
-        if not os.path.exists(baseline_file):
-            with open(baseline_file, "w") as bf:
-                json.dump(baseline, bf)
-                bf.flush()
-                os.fsync(bf.fileno())  # ensure baseline is written to disk
-        else:
+            _baseline_cache = {"day": today, "wh": e_wh}
             try:
-                with open(baseline_file) as bf:
-                    prev = json.load(bf)
-                if prev.get("day") != today:
-                    with open(baseline_file, "w") as bf:
-                        json.dump(baseline, bf)
-                        bf.flush()
-                        os.fsync(bf.fileno())  # ensure baseline is written to disk
+                _write_atomic(BASELINE_PATH, orjson.dumps(_baseline_cache))
             except Exception as e:
-                log.warning(f"Baseline check failed: {e}")
+                log.warning(f"Baseline write failed: {e}")
 
         if DEBUG:
             # log.debug(f"Decoded: V={v} F={f} P={p} E={e_wh:.2f}Wh SF={sf}")
@@ -213,9 +357,11 @@ def read_legacy_block():
         return None
 
 # ---------- Poller ----------
-def poller_loop():
+def poller_loop() -> None:
+    global _baseline_cache
     log.info(f"Starting poller @ {MODBUS_HOST}:{MODBUS_PORT}, {POLL_SECONDS}s")
     load_state()
+    _publish_snapshot()
     while not stop_event.is_set():
         now = datetime.now()
         data = None
@@ -225,13 +371,13 @@ def poller_loop():
             last_midnight = state.get("_midnight")
         if not last_midnight or datetime.fromisoformat(last_midnight) < midnight:
             log.info("🕛 Midnight rollover — resetting daily baseline")
-            baseline_file = os.path.join(STATE_DIR, "energy_baseline.json")
-            if os.path.exists(baseline_file):
-                os.remove(baseline_file)
+            _baseline_cache = None
+            if os.path.exists(BASELINE_PATH):
+                os.remove(BASELINE_PATH)
             with state_lock:
                 state["_midnight"] = midnight.isoformat()
                 state["uptime_minutes_today"] = 0  # ← Reset uptime each new day
-                state["records"] = []  # ← Reset chart data for new day
+                _labels.clear(); _powers.clear(); _energies.clear()  # ← Reset chart data for new day
         try:
             data = read_legacy_block()
             if data:
@@ -299,26 +445,20 @@ def poller_loop():
                 if not is_night:
                     # Compare against previous readings to avoid duplicate uploads
                     prev_e = state.get("_last_energy_wh", 0)
-                    prev_p = state.get("records", [{}])[-1].get("power_w", 0) if state.get("records") else 0
+                    prev_p = _powers[-1] if _powers else 0
 
                     if abs(e_wh_today - prev_e) >= 1 or abs(p - prev_p) >= 5:
-                        if pvoutput_addstatus(int(p), float(e_wh_today), voltage_v=v, temp_c=t):
-                            state["last_upload"] = now.isoformat(timespec="seconds")
+                        enqueue_upload(int(p), float(e_wh_today), v, t, now)
                     else:
                         log.debug("No change in power/energy; skipping PVOutput upload")
                 else:
                     log.info("Nighttime — skipping PVOutput upload (inverter asleep)")
 
-                # Append chart record (store today's Wh so chart shows kWh when /1000)
-                rec = {
-                    "timestamp": now.isoformat(timespec="seconds"),
-                    "power_w": int(p),
-                    "energy_wh": int(e_wh_today)
-                }
+                # Append chart sample (today's energy as kWh, ready to plot)
                 with state_lock:
-                    if len(state["records"]) >= 288:
-                        state["records"].pop(0)
-                    state["records"].append(rec)
+                    _labels.append(now.strftime("%H:%M"))
+                    _powers.append(int(p))
+                    _energies.append(int(e_wh_today) / 1000)
                 save_state()
 
             else:
@@ -350,93 +490,70 @@ def poller_loop():
                 state["dq_class"] = dq_class
         except Exception as e:
             log.warning(f"Poll error: {e}")
+        _publish_snapshot()
         stop_event.wait(POLL_SECONDS)
 # ---------- Flask ----------
-app=Flask(__name__)
-
-@app.route("/")
-def root():
-    s = _with_lock_read()
-    e_today = f"{s.get('energy_today_kwh',0):.3f} kWh"
-
-    # --- Format timestamps without 'T' ---
-    lp = s.get('last_upload', '—')
-    if isinstance(lp, str) and 'T' in lp:
-        lp = lp.replace('T', ' ')
-    last_poll = s.get('_last_sample_ts')
-    if last_poll:
-        try:
-            dt = datetime.fromisoformat(last_poll)
-            last_poll = dt.strftime("%Y-%m-%d %H:%M:%S")
-        except Exception:
-            last_poll = str(last_poll).replace('T', ' ')
-    else:
-        last_poll = '—'
-    # --- Format uptime as hours and minutes ---
-    uptime_min = s.get('uptime_minutes_today', 0)
-    hours, mins = divmod(int(uptime_min), 60)
-    uptime_str = f"{hours}h {mins}m"
-    # --- Build the HTML page ---
-    html = f"""
+# Dashboard page, compiled once; root() only substitutes the live values.
+_HTML_TMPL = string.Template("""
 <!doctype html><html><head>
 <meta charset='utf-8'/>
 <meta name="viewport" content="width=device-width, initial-scale=1">
 <link rel="icon" type="image/x-icon" href="/static/favicon.ico">
-<title>VSN300 → PVOutput ({s['status_text']})</title>
+<title>VSN300 → PVOutput ($status_text)</title>
 <script src='https://cdn.jsdelivr.net/npm/chart.js'></script>
 <style>
-body{{font-family:system-ui;background:#0b1020;color:#e6ecff;margin:20px;}}
-.status{{background:#121a33;border-radius:12px;padding:16px;max-width:320px;min-width:300px;}}
-.chart{{background:#121a33;border-radius:16px;padding:16px;flex-grow:1;height:65vh;}}
-.pill{{padding:2px 8px;border-radius:12px;font-size:12px;margin-left:6px;}}
-.ok{{background:#14331a;color:#7fff9c;}}
-.sleep{{background:#0f203a;color:#8fc5ff;}}
-.error{{background:#3a0f0f;color:#ff6b6b;}}
-.muted{{color:#9fb0ff;}}
-.night{{background:#1e2233;color:#b0c8ff;}}
-.dq_ok{{display:inline-block;width:10px;height:10px;border-radius:50%;background:#00ff88;margin-left:8px;}}
-.dq_warn{{display:inline-block;width:10px;height:10px;border-radius:50%;background:#ffbb00;margin-left:8px;}}
-.dq_off{{display:inline-block;width:10px;height:10px;border-radius:50%;background:#ff4444;margin-left:8px;}}
+body{font-family:system-ui;background:#0b1020;color:#e6ecff;margin:20px;}
+.status{background:#121a33;border-radius:12px;padding:16px;max-width:320px;min-width:300px;}
+.chart{background:#121a33;border-radius:16px;padding:16px;flex-grow:1;height:65vh;}
+.pill{padding:2px 8px;border-radius:12px;font-size:12px;margin-left:6px;}
+.ok{background:#14331a;color:#7fff9c;}
+.sleep{background:#0f203a;color:#8fc5ff;}
+.error{background:#3a0f0f;color:#ff6b6b;}
+.muted{color:#9fb0ff;}
+.night{background:#1e2233;color:#b0c8ff;}
+.dq_ok{display:inline-block;width:10px;height:10px;border-radius:50%;background:#00ff88;margin-left:8px;}
+.dq_warn{display:inline-block;width:10px;height:10px;border-radius:50%;background:#ffbb00;margin-left:8px;}
+.dq_off{display:inline-block;width:10px;height:10px;border-radius:50%;background:#ff4444;margin-left:8px;}
 </style></head><body>
 <h2>
 VSN300 → PVOutput 
-<span class='pill {s['status_class']}'>{s['status_text']}</span>
-<span class='{s.get('dq_class','dq_off')}' title='Data Quality: {s.get('dq_text','NO DATA')}'></span>
+<span class='pill $status_class'>$status_text</span>
+<span class='$dq_class' title='Data Quality: $dq_text'></span>
 </h2>
 <div style='display:flex;flex-wrap:wrap;gap:20px;align-items:flex-start;'>
 <div class='status'>
-<b>Power:</b> {s.get('records', [])[-1].get('power_w', 0) if s.get('records') else 0} W<br>
-<b>Energy Today:</b> {e_today}<br>
-<b>Lifetime Energy:</b> {s.get('energy_total_kwh','—')} kWh<br>
-<b>AC Voltage:</b> {s.get('ac_voltage','—')} V<br>
-<b>Temp:</b> {s.get('inverter_temp_c','—')} °C<br>
-<b>Freq:</b> {s.get('grid_freq_hz','—')} Hz<br>
-<b>PVOutput Mode:</b> {'DRY RUN' if s['dry_run'] else 'LIVE'}<br>
-<b>Last Poll:</b> {last_poll}<br>
-<b>Last Upload:</b> {lp}<br>
-<b>Uptime:</b> {uptime_str}<br>
+<b>Power:</b> $power_w W<br>
+<b>Energy Today:</b> $e_today<br>
+<b>Lifetime Energy:</b> $energy_total kWh<br>
+<b>AC Voltage:</b> $ac_voltage V<br>
+<b>Temp:</b> $inverter_temp °C<br>
+<b>Freq:</b> $grid_freq Hz<br>
+<b>PVOutput Mode:</b> $mode<br>
+<b>Last Poll:</b> $last_poll<br>
+<b>Last Upload:</b> $last_upload<br>
+<b>Uptime:</b> $uptime<br>
 <a href='/raw' style='color:#8fc5ff;'>Diagnostics / raw</a>
 </div>
 <div class='chart'><canvas id='c'></canvas></div></div>
 <script>
 let ch;
-async function load(){{const r=await fetch('/data');return r.json();}}
-function draw(l,p,e){{
-  if(!ch) {{
-    ch = new Chart(document.getElementById('c'), {{
+async function load(){const r=await fetch('/data');return r.json();}
+function draw(l,p,e){
+  if(!ch) {
+    ch = new Chart(document.getElementById('c'), {
       type: 'line',
-      data: {{
+      data: {
         labels: l,
         datasets: [
-          {{
+          {
             label: 'Power (W)',
             data: p,
             yAxisID: 'y',
             borderColor: '#5a8e56',   // was 007f3f dark green
             tension: .25,
             fill: false
-          }},
-          {{
+          },
+          {
             label: 'Energy (kWh)',
             data: e,
             yAxisID: 'y1',
@@ -444,109 +561,178 @@ function draw(l,p,e){{
             backgroundColor: '#e1ffa5', // was rgba(0,255,153,0.15) soft green fill
             tension: .3,
             fill: true
-          }}
+          }
         ]
-      }},
-      options: {{
+      },
+      options: {
         responsive: true,
         maintainAspectRatio: false,
-        scales: {{
-          x: {{
+        scales: {
+          x: {
             offset: false,
-            ticks: {{ color: '#e6ecff' }}
-          }},
-          y: {{
+            ticks: { color: '#e6ecff' }
+          },
+          y: {
             beginAtZero: true,
             position: 'left',
-            grid: {{ offset: false }},
-            ticks: {{ color: '#e6ecff' }},
-            title: {{
+            grid: { offset: false },
+            ticks: { color: '#e6ecff' },
+            title: {
               display: true,
               text: 'Power (W)',
               color: '#e6ecff'
-            }}
-          }},
-          y1: {{
+            }
+          },
+          y1: {
             beginAtZero: true,
             position: 'right',
-            grid: {{ drawOnChartArea: false, offset: false }},
-            ticks: {{ color: '#e6ecff' }},
-            title: {{
+            grid: { drawOnChartArea: false, offset: false },
+            ticks: { color: '#e6ecff' },
+            title: {
               display: true,
               text: 'Energy (kWh)',
               color: '#e6ecff'
-            }}
-          }}
-        }},
-        layout: {{ padding: 0 }},
-        plugins: {{
-          legend: {{
-            labels: {{
+            }
+          }
+        },
+        layout: { padding: 0 },
+        plugins: {
+          legend: {
+            labels: {
               color: '#e6ecff',
-              font: {{ size: 13, family: 'system-ui' }},
+              font: { size: 13, family: 'system-ui' },
               padding: 12
-            }}
-          }},
-          title: {{
+            }
+          },
+          title: {
             display: true,
             text: 'Live Power and Energy',
             color: '#e6ecff',
-            font: {{ size: 16, weight: 'bold', family: 'system-ui' }},
-            padding: {{ top: 8, bottom: 8 }}
-          }},
-          tooltip: {{
+            font: { size: 16, weight: 'bold', family: 'system-ui' },
+            padding: { top: 8, bottom: 8 }
+          },
+          tooltip: {
             titleColor: '#e6ecff',
             bodyColor: '#e6ecff',
             backgroundColor: 'rgba(18,26,51,0.9)',
             borderColor: '#00ff99',
             borderWidth: 1
-          }}
-        }}
-      }}
-    }});
-  }} else {{
+          }
+        }
+      }
+    });
+  } else {
     ch.data.labels = l;
     ch.data.datasets[0].data = p;
     ch.data.datasets[1].data = e;
     ch.update();
-  }}
-}}
-async function refresh(){{ 
+  }
+}
+async function refresh(){ 
   const d = await load(); 
-  const r = d.records || []; 
-  draw(
-    r.map(x => (x.timestamp || '').slice(11,16)),
-    r.map(x => x.power_w),
-    r.map(x => (x.energy_wh || 0) / 1000)
-  );
-}}
+  const r = d.records || {}; 
+  draw(r.l || [], r.p || [], r.e || []);
+}
 refresh();
 setInterval(refresh,60000);
-</script></body></html>"""
-    return Response(html, mimetype="text/html")
+</script></body></html>""")
+
+# Folded into the / ETag so a changed page or script invalidates cached copies
+_HTML_HASH = hashlib.md5(_HTML_TMPL.template.encode()).hexdigest()[:8]
+
+app=Flask(__name__)
+Compress(app)
+
+def _not_modified(etag: str | None) -> Response | None:
+    """Return a 304 response if the client's If-None-Match already holds `etag`."""
+    if not etag:
+        return None
+    for tag in request.if_none_match:
+        # Compress rewrites the tag of compressed bodies as "<etag>:<encoding>";
+        # the 304 repeats whichever validator the client sent.
+        if tag.partition(":")[0] == etag:
+            return Response(status=304, headers={"ETag": f'"{tag}"', "Cache-Control": "no-cache, max-age=0"})
+    return None
+
+def _tagged(resp: Response, etag: str | None) -> Response:
+    """Attach the snapshot ETag and require revalidation on every use."""
+    if etag:
+        resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "no-cache, max-age=0"
+    return resp
+
+@app.route("/")
+def root() -> Response:
+    etag = f"{_snapshot_etag}-{_HTML_HASH}" if _snapshot_etag else None
+    not_modified = _not_modified(etag)
+    if not_modified: return not_modified
+    s = _read_snapshot()
+    e_today = f"{s.get('energy_today_kwh',0):.3f} kWh"
+
+    # --- Format timestamps without 'T' ---
+    lp = s.get('last_upload', '—')
+    if isinstance(lp, str) and 'T' in lp:
+        lp = lp.replace('T', ' ')
+    last_poll = s.get('_last_sample_ts')
+    if last_poll:
+        try:
+            dt = datetime.fromisoformat(last_poll)
+            last_poll = dt.strftime("%Y-%m-%d %H:%M:%S")
+        except Exception:
+            last_poll = str(last_poll).replace('T', ' ')
+    else:
+        last_poll = '—'
+    # --- Format uptime as hours and minutes ---
+    uptime_min = s.get('uptime_minutes_today', 0)
+    hours, mins = divmod(int(uptime_min), 60)
+    uptime_str = f"{hours}h {mins}m"
+    # --- Fill the precompiled HTML page ---
+    html = _HTML_TMPL.substitute(
+        status_text=s['status_text'], status_class=s['status_class'],
+        dq_class=s.get('dq_class','dq_off'), dq_text=s.get('dq_text','NO DATA'),
+        power_w=s['records']['p'][-1] if s['records']['p'] else 0,
+        e_today=e_today, energy_total=s.get('energy_total_kwh','—'),
+        ac_voltage=s.get('ac_voltage','—'), inverter_temp=s.get('inverter_temp_c','—'),
+        grid_freq=s.get('grid_freq_hz','—'), mode='DRY RUN' if s['dry_run'] else 'LIVE',
+        last_poll=last_poll, last_upload=lp, uptime=uptime_str,
+    )
+    return _tagged(Response(html, mimetype="text/html"), etag)
 
 @app.route("/data")
-def data():
-    try:
+def data() -> Response:
+    etag, body = _snapshot_etag, _snapshot_json
+    not_modified = _not_modified(etag)
+    if not_modified: return not_modified
+    if body is None:
+        # Before the first poll publishes, send the saved state file as-is
+        # (written via tmp+rename, so it is never partial).
         if os.path.exists(STATE_PATH):
-            with open(STATE_PATH) as f: return jsonify(json.load(f))
-    except: pass
-    return jsonify(_with_lock_read())
+            return send_from_directory(STATE_DIR, "state.json",
+                                       mimetype="application/json", max_age=0)
+        return _json_response(dict(_read_snapshot()))
+    return _tagged(Response(body, mimetype="application/json"), etag)
 
 @app.route("/raw")
-def raw():
+def raw() -> Response:
     try:
-        return jsonify({
-            "timestamp": datetime.now().isoformat(),
-            "regs_80_119": read_regs(80, 40)
-        })
+        if request.args.get("fresh") == "1":
+            # Explicit re-read over the shared Modbus connection (debugging only)
+            return _json_response({
+                "timestamp": datetime.now().isoformat(),
+                "regs_80_119": read_regs(80, 40)
+            })
+        ts, regs = _last_raw
+        return _json_response({"timestamp": ts, "regs_80_119": regs})
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return _json_response({"error": str(e)}, 500)
 
 # ---------- Main ----------
-def _sig(sig,frm): log.info(f"Signal {sig}"); stop_event.set()
-if __name__=="__main__":
+def _sig(sig: int, frm: Any) -> None: log.info(f"Signal {sig}"); stop_event.set()
+def main() -> None:
     signal.signal(signal.SIGTERM,_sig); signal.signal(signal.SIGINT,_sig)
     threading.Thread(target=poller_loop,daemon=True).start()
+    threading.Thread(target=uploader_loop,daemon=True).start()
     log.info("Serving dashboard on 0.0.0.0:8080 (http://localhost:8080)")
-    app.run(host="0.0.0.0",port=8080,threaded=True)
+    serve(app,host="0.0.0.0",port=8080,threads=4)
+if __name__=="__main__":
+    main()